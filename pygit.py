@@ -20,6 +20,9 @@ def main():
     command_args = sys.argv[2:]
 
     command_func = getattr(commands, command_name, None)
+    # Only functions defined in commands.py are commands, not private helpers or names it imports
+    if command_name.startswith('_') or getattr(command_func, '__module__', None) != commands.__name__:
+        command_func = None
 
     if command_func:
         try:
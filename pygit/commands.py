@@ -2,61 +2,182 @@ import os
 import sys
 import collections
 from datetime import datetime
-import json
-import fnmatch
+import re
 import shutil
-
-from .repository import find_pygit_dir, init as repo_init
-from .objects import read_object, hash_object, get_commit_tree, get_tree_contents, pretty_print_object
-from .index import read_index, write_index
-from .refs import get_head_ref, get_head_commit, update_head, get_branch_commit, create_tag, list_tags, read_stash, \
-    write_stash
+from concurrent.futures import ThreadPoolExecutor
+
+from .repository import PYGIT_DIR, LOCK_SUFFIX, find_pygit_dir, find_repo_root, init as repo_init
+from .objects import TAG_TARGET_LENGTH, read_object, read_object_head, read_object_into, \
+    hash_object, hash_file, write_tree, get_commit_tree, get_tree_contents, pretty_print_object
+from .index import read_index, write_index, read_stat_cache, write_stat_cache, lookup_stat_cache, \
+    stat_cache_entry, racy_cutoff
+from .refs import load_head, get_head_commit, update_head, write_ref_atomic, get_branch_commit, create_tag, list_tags, \
+    list_refs, read_stash, write_stash
 from .diff import compare_files, compare_trees
-from .utils import get_commit_history, find_common_ancestor, get_full_history_set
+from .utils import get_commit_parents, get_commit_history, find_common_ancestor, get_full_history_set, \
+    iter_boundary_commits
 from .resolver import resolve_ref, resolve_ref_to_commit
 from .config import read_config, write_config
 from .remote import add_remote, remove_remote, list_remotes
+from .ignore import read_gitignore
+from .commit_graph import append_commit, iter_commit_graph
+
+
+_AUTHOR_RE = re.compile(rb'^author (.*)$', re.M)
+
+
+def _iter_worktree(root, prefix='', include_dirs=False, prune=None):
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir():
+                if entry.name == PYGIT_DIR:
+                    continue
+                dirpath = prefix + entry.name
+                if prune is not None and prune(dirpath):
+                    continue
+                if include_dirs:
+                    yield dirpath, entry
+                if not entry.is_symlink():
+                    yield from _iter_worktree(entry.path, dirpath + '/', include_dirs, prune)
+            else:
+                yield prefix + entry.name, entry
+
+
+def _hash_files(paths, write=True):
+    if len(paths) < 2:
+        return [hash_file(path, 'blob', write=write) for path in paths]
+    # hashlib releases the GIL while hashing
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        return list(executor.map(lambda path: hash_file(path, 'blob', write=write), paths))
+
+
+def _index_dirs(index_tree):
+    # Every directory that contains a tracked file, at any depth
+    dirs = set()
+    for filepath in index_tree:
+        end = filepath.rfind('/')
+        while end > 0:
+            dirpath = filepath[:end]
+            if dirpath in dirs:
+                break
+            dirs.add(dirpath)
+            end = filepath.rfind('/', 0, end)
+    return dirs
+
+
+def _stat_tracked(repo_root, filepaths):
+    tracked = []
+    for filepath in filepaths:
+        full_path = os.path.join(repo_root, filepath)
+        try:
+            st = os.stat(full_path)
+        except FileNotFoundError:
+            continue
+        tracked.append((filepath, full_path, st))
+    return tracked
+
+
+def _hash_tracked_files(tracked, stat_cache, index_tree, write=False):
+    hashes, misses = {}, []
+    for filepath, full_path, st in tracked:
+        cached = lookup_stat_cache(stat_cache, filepath, st)
+        # Only the index's sha is known to be stored; status caches shas without writing
+        if cached is None or (write and cached != index_tree[filepath]):
+            misses.append((st.st_ino, filepath, full_path))
+        else:
+            hashes[filepath] = cached
 
+    # Inode order keeps cold reads close to sequential
+    misses.sort()
+    digests = _hash_files([full_path for _, _, full_path in misses], write=write)
+    hashes.update(zip((filepath for _, filepath, _ in misses), digests))
+    return hashes
 
-def _read_gitignore():
-    pygit_dir = find_pygit_dir()
-    if not pygit_dir: return set()
-    repo_root = os.path.dirname(pygit_dir)
-    gitignore_path = os.path.join(repo_root, '.gitignore')
-    if not os.path.exists(gitignore_path):
-        return set()
-    with open(gitignore_path, 'r') as f:
-        return {line.strip() for line in f if line.strip() and not line.startswith('#')}
-
-
-def _is_ignored(filepath, gitignore_patterns):
-    filepath = filepath.replace(os.sep, '/')
-    for pattern in gitignore_patterns:
-        if pattern.endswith('/'):
-            if filepath.startswith(pattern) or filepath == pattern.rstrip('/'):
-                return True
-        if fnmatch.fnmatch(filepath, pattern):
-            return True
-    return False
+
+def _update_stat_cache(stat_cache, tracked, hashes):
+    # Racily clean files may still change without a stat change
+    cutoff = racy_cutoff()
+    new_stat_cache = {filepath: stat_cache_entry(st, hashes[filepath])
+                      for filepath, _, st in tracked if st.st_mtime_ns < cutoff}
+    if new_stat_cache != stat_cache:
+        write_stat_cache(new_stat_cache)
+
+
+def _write_tree_file(repo_root, filepath, sha1):
+    if read_object_into(sha1, os.path.join(repo_root, filepath)) is None:
+        raise FileNotFoundError(f"object {sha1} for '{filepath}' is missing")
+
+
+def _write_tree_files(repo_root, tree):
+    for dirpath in sorted({os.path.dirname(filepath) for filepath in tree} - {''}):
+        os.makedirs(os.path.join(repo_root, dirpath), exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        futures = [executor.submit(_write_tree_file, repo_root, filepath, sha1) for filepath, sha1 in tree.items()]
+        for future in futures:
+            future.result()
+
+
+def _remove_worktree_files(repo_root, filepaths):
+    parent_dirs = set()
+    for filepath in filepaths:
+        try:
+            os.unlink(os.path.join(repo_root, filepath))
+        except FileNotFoundError:
+            pass
+        parent = os.path.dirname(filepath)
+        while parent and parent not in parent_dirs:
+            parent_dirs.add(parent)
+            parent = os.path.dirname(parent)
+    return parent_dirs
+
+
+def _remove_empty_dirs(repo_root, dirpaths):
+    # Deepest first
+    for dirpath in sorted(dirpaths, key=len, reverse=True):
+        try:
+            os.rmdir(os.path.join(repo_root, dirpath))
+        except OSError:
+            pass
+
+
+def _switch_worktree(repo_root, old_tree, new_tree, reset=False):
+    stale_dirs = _remove_worktree_files(repo_root, old_tree.keys() - new_tree.keys())
+    # Unchanged paths keep their local edits unless resetting
+    changed = new_tree if reset else {filepath: sha1 for filepath, sha1 in new_tree.items()
+                                      if old_tree.get(filepath) != sha1}
+    _write_tree_files(repo_root, changed)
+    _remove_empty_dirs(repo_root, stale_dirs - _index_dirs(new_tree))
+    write_index(new_tree)
 
 
-def _create_commit(message, tree_sha1, parents):
+def _create_commit(message, tree_sha1, parents, in_commit_graph=True):
     config = read_config()
     author_name = config.get('user.name', 'PyGit User')
     author_email = config.get('user.email', 'user@pygit.com')
-    author_string = f"{author_name} <{author_email}>"
-
-    parent_lines = "".join(f"parent {p}\n" for p in parents) if parents else "parent None\n"
-
-    commit_data = (
-        f"tree {tree_sha1}\n"
-        f"{parent_lines}"
-        f"author {author_string} {datetime.now().isoformat()}\n"
-        f"committer {author_string} {datetime.now().isoformat()}\n"
-        f"\n"
-        f"{message}\n"
-    ).encode()
-    return hash_object(commit_data, 'commit')
+    signature = f"{author_name} <{author_email}> {datetime.now().isoformat()}\n".encode()
+
+    parent_lines = b"".join(b"parent " + p.encode() + b"\n" for p in parents) if parents else b"parent None\n"
+
+    commit_data = b"".join([
+        b"tree ", tree_sha1.encode(), b"\n",
+        parent_lines,
+        b"author ", signature,
+        b"committer ", signature,
+        b"\n",
+        message.encode(), b"\n",
+    ])
+    commit_sha1 = hash_object(commit_data, 'commit')
+    if in_commit_graph:
+        append_commit(commit_sha1, parents[0] if parents else None, signature[:-1], message.encode())
+    return commit_sha1
+
+
+def _advance_head(head, commit_sha1):
+    if head.is_branch:
+        write_ref_atomic(os.path.join(find_pygit_dir(), head.ref), commit_sha1)
+    else:
+        update_head(commit_sha1, detached=True)
 
 
 def _resolve_ref_or_head(ref_name, to_commit=True):
@@ -73,26 +194,55 @@ def init():
     repo_init()
 
 
-def add(filepath):
-    gitignore_patterns = _read_gitignore()
-    if _is_ignored(filepath, gitignore_patterns):
-        print(f"Ignoring '{filepath}' due to .gitignore")
-        return
-
-    if not os.path.exists(filepath):
-        print(f"Error: file not found: {filepath}", file=sys.stderr)
+def add(*filepaths):
+    if not filepaths:
+        print("Usage: pygit add <file>...", file=sys.stderr)
         return False
 
-    with open(filepath, 'rb') as f:
-        content = f.read()
-    sha1 = hash_object(content, 'blob')
-    if not sha1: return False
-
+    ignore = read_gitignore()
     index = read_index()
-    index[filepath] = sha1
-    write_index(index)
+    stat_cache = read_stat_cache()
+    cutoff = racy_cutoff()
+    failed = changed = False
+    to_stage, to_hash = [], []
+
+    for filepath in filepaths:
+        if ignore.is_ignored(filepath):
+            print(f"Ignoring '{filepath}' due to .gitignore")
+            continue
+
+        try:
+            st = os.stat(filepath)
+        except FileNotFoundError:
+            print(f"Error: file not found: {filepath}", file=sys.stderr)
+            failed = True
+            continue
+
+        # Unchanged since it was staged, so the blob is already stored
+        if filepath in index and lookup_stat_cache(stat_cache, filepath, st) == index[filepath]:
+            to_stage.append((filepath, None))
+            continue
+        to_stage.append((filepath, st))
+        to_hash.append(filepath)
+
+    hashes = dict(zip(to_hash, _hash_files(to_hash)))
+    for filepath, st in to_stage:
+        if st is not None:
+            sha1 = hashes[filepath]
+            if not sha1:
+                failed = True
+                continue
 
-    print(f"Staged '{filepath}' for commit.")
+            index[filepath] = sha1
+            if st.st_mtime_ns < cutoff:
+                stat_cache[filepath] = stat_cache_entry(st, sha1)
+            changed = True
+        print(f"Staged '{filepath}' for commit.")
+
+    if changed:
+        write_index(index)
+        write_stat_cache(stat_cache)
+    if failed: return False
 
 
 def rm(filepath):
@@ -126,47 +276,65 @@ def commit(*args):
         print("Nothing to commit, staging area is empty.")
         return
 
-    tree_sha1 = hash_object(json.dumps(index, sort_keys=True).encode(), 'tree')
-    parent_sha1 = get_head_commit()
-    parents = [parent_sha1] if parent_sha1 else []
+    tree_sha1 = write_tree(index)
+    head = load_head()
+    parents = [head.commit_sha] if head.commit_sha else []
 
     commit_sha1 = _create_commit(message, tree_sha1, parents)
-
-    head_ref = get_head_ref()
-    if head_ref.startswith('refs/heads/'):
-        pygit_dir = find_pygit_dir()
-        branch_path = os.path.join(pygit_dir, head_ref)
-        with open(branch_path, 'w') as f:
-            f.write(commit_sha1)
-    else:
-        update_head(commit_sha1, detached=True)
+    _advance_head(head, commit_sha1)
 
     print(f"Committed, commit hash: {commit_sha1}")
 
 
-def log():
-    for commit_sha1, commit_content in get_commit_history(get_head_commit()):
-        print(f"commit {commit_sha1}")
-
-        lines = commit_content.decode().split('\n')
-        author_line = next((line for line in lines if line.startswith('author ')), "")
-        print(f"Author: {author_line.split(' ', 1)[1]}")
+def _log_entry(commit_sha1):
+    obj_type, content = read_object(commit_sha1)
+    if obj_type != 'commit': return None
+    header, _, message = content.partition(b'\n\n')
+    author_match = _AUTHOR_RE.search(header)
+    parents = get_commit_parents(content)
+    return parents[0] if parents else None, author_match.group(1) if author_match else b'', message
 
-        message_start_index = commit_content.find(b'\n\n') + 2
-        print(f"\n    {commit_content[message_start_index:].decode().strip()}\n")
 
+def _graph_entry(records, seen, commit_sha1):
+    # Reads graph records, newest first, until commit_sha1 turns up
+    while commit_sha1 not in seen:
+        record = next(records, None)
+        if record is None: return None
+        seen[record[0]] = record[1:]
+    return seen.pop(commit_sha1)
 
-def status():
-    head_ref = get_head_ref()
-    head_commit = get_head_commit()
 
-    if not head_ref.startswith('refs/heads/'):
-        if head_commit:
-            print(f"HEAD detached at {head_commit[:7]}")
-        else:
-            print("HEAD detached (no commit)")
-    else:
-        print(f"On branch {head_ref.split('/')[-1]}")
+def log():
+    records, seen = iter_commit_graph(), {}
+    commit_sha1 = get_head_commit()
+    while commit_sha1:
+        entry = _graph_entry(records, seen, commit_sha1) or _log_entry(commit_sha1)
+        if entry is None: return
+        parent_sha1, author, message = entry
+        print(f"commit {commit_sha1}")
+        print(f"Author: {author.decode()}")
+        print(f"\n    {message.decode().strip()}\n")
+        commit_sha1 = parent_sha1
+
+
+def _print_porcelain(staged_added, staged_deleted, staged_modified, unstaged_modified, unstaged_deleted,
+                     untracked_files):
+    # Git's porcelain v1 format
+    codes = collections.defaultdict(lambda: [' ', ' '])
+    for f in staged_added: codes[f][0] = 'A'
+    for f in staged_modified: codes[f][0] = 'M'
+    for f in staged_deleted: codes[f][0] = 'D'
+    for f in unstaged_modified: codes[f][1] = 'M'
+    for f in unstaged_deleted: codes[f][1] = 'D'
+    for f in sorted(codes): print(f"{''.join(codes[f])} {f}")
+    for f in sorted(untracked_files): print(f"?? {f}")
+
+
+def status(*args):
+    show_untracked = not any(arg in ('-uno', '--untracked-files=no') for arg in args)
+    porcelain = '--porcelain' in args
+    head = load_head()
+    head_commit = head.commit_sha
 
     head_tree = {}
     if head_commit:
@@ -174,40 +342,54 @@ def status():
     index_tree = read_index()
 
     staged_added, staged_deleted, staged_modified = compare_trees(head_tree, index_tree)
-    print("\nChanges to be committed:")
-    if not any([staged_added, staged_deleted, staged_modified]):
-        print("  (no changes staged)")
-    for f in sorted(staged_added): print(f"  new file:   {f}")
-    for f in sorted(staged_modified): print(f"  modified:   {f}")
-    for f in sorted(staged_deleted): print(f"  deleted:    {f}")
-    print()
 
-    unstaged_modified, unstaged_deleted, untracked_files = [], [], []
-    pygit_dir = find_pygit_dir()
-    repo_root = os.path.dirname(pygit_dir)
-    gitignore_patterns = _read_gitignore()
+    untracked_files = []
+    repo_root = find_repo_root()
+    ignore = read_gitignore()
 
+    tracked = []
     files_in_index = set(index_tree.keys())
-    for root, dirs, files in os.walk(repo_root):
-        if '.pygit' in dirs:
-            dirs.remove('.pygit')
-
-        for filename in files:
-            filepath = os.path.relpath(os.path.join(root, filename), repo_root)
-            if _is_ignored(filepath, gitignore_patterns):
-                continue
-
+    if show_untracked:
+        # Ignored directories are still walked when they hold tracked files
+        tracked_dirs = _index_dirs(index_tree)
+        prune = lambda dirpath: ignore.excludes_dir(dirpath) and dirpath not in tracked_dirs
+        for filepath, entry in _iter_worktree(repo_root, prune=prune):
             if filepath in files_in_index:
-                with open(os.path.join(repo_root, filepath), 'rb') as f:
-                    workdir_hash = hash_object(f.read(), 'blob')
-                if workdir_hash != index_tree[filepath]:
-                    unstaged_modified.append(filepath)
+                tracked.append((filepath, entry.path, entry.stat()))
                 files_in_index.remove(filepath)
-            else:
+            elif not ignore.is_ignored(filepath):
                 untracked_files.append(filepath)
+    else:
+        tracked = _stat_tracked(repo_root, index_tree)
+        files_in_index.difference_update(filepath for filepath, _, _ in tracked)
 
+    stat_cache = read_stat_cache()
+    workdir_hashes = _hash_tracked_files(tracked, stat_cache, index_tree)
+    _update_stat_cache(stat_cache, tracked, workdir_hashes)
+    unstaged_modified = [filepath for filepath, _, _ in tracked if workdir_hashes[filepath] != index_tree[filepath]]
     unstaged_deleted = list(files_in_index)
 
+    if porcelain:
+        _print_porcelain(staged_added, staged_deleted, staged_modified, unstaged_modified, unstaged_deleted,
+                         untracked_files)
+        return
+
+    if not head.is_branch:
+        if head_commit:
+            print(f"HEAD detached at {head_commit[:7]}")
+        else:
+            print("HEAD detached (no commit)")
+    else:
+        print(f"On branch {head.branch_name}")
+
+    print("\nChanges to be committed:")
+    if not any([staged_added, staged_deleted, staged_modified]):
+        print("  (no changes staged)")
+    for f in staged_added: print(f"  new file:   {f}")
+    for f in staged_modified: print(f"  modified:   {f}")
+    for f in staged_deleted: print(f"  deleted:    {f}")
+    print()
+
     print("Changes not staged for commit:")
     if not unstaged_modified and not unstaged_deleted:
         print("  (use 'pygit add <file>...' to stage changes)")
@@ -215,6 +397,10 @@ def status():
     for f in sorted(unstaged_deleted): print(f"  deleted:    {f}")
     print()
 
+    if not show_untracked:
+        print("Untracked files not listed (use 'pygit status' to show untracked files)")
+        return
+
     print("Untracked files:")
     if not untracked_files:
         print("  (use 'pygit add <file>...' to include in what will be committed)")
@@ -224,18 +410,20 @@ def status():
 def branch(branch_name=None, start_point=None):
     pygit_dir = find_pygit_dir()
     heads_dir = os.path.join(pygit_dir, 'refs', 'heads')
-    head_ref = get_head_ref()
-    current_branch = head_ref.split('/')[-1] if head_ref.startswith('refs/heads/') else None
+    current_branch = load_head().branch_name
 
     if not branch_name:
-        branches = os.listdir(heads_dir)
-        for b in sorted(branches):
+        for b in list_refs(heads_dir):
             if b == current_branch:
                 print(f"* {b}")
             else:
                 print(f"  {b}")
         return
 
+    if branch_name.endswith(LOCK_SUFFIX):
+        print(f"Error: '{branch_name}' is not a valid branch name.", file=sys.stderr)
+        return False
+
     new_branch_path = os.path.join(heads_dir, branch_name)
     if os.path.exists(new_branch_path):
         print(f"Error: branch '{branch_name}' already exists.", file=sys.stderr)
@@ -247,14 +435,12 @@ def branch(branch_name=None, start_point=None):
         print(f"Error: could not resolve '{start_point_ref}' to a commit.", file=sys.stderr)
         return False
 
-    with open(new_branch_path, 'w') as f:
-        f.write(commit_hash)
+    write_ref_atomic(new_branch_path, commit_hash)
     print(f"Branch '{branch_name}' created.")
 
 
 def checkout(name):
-    pygit_dir = find_pygit_dir()
-    repo_root = os.path.dirname(pygit_dir)
+    repo_root = find_repo_root()
 
     old_head_commit = get_head_commit()
     old_tree = get_tree_contents(get_commit_tree(old_head_commit)) if old_head_commit else {}
@@ -266,28 +452,7 @@ def checkout(name):
 
     new_tree = get_tree_contents(get_commit_tree(commit_sha1))
 
-    files_to_delete = set(old_tree.keys()) - set(new_tree.keys())
-    for filepath in files_to_delete:
-        full_path = os.path.join(repo_root, filepath)
-        if os.path.exists(full_path):
-            os.remove(full_path)
-
-    for filepath, sha1 in new_tree.items():
-        full_path = os.path.join(repo_root, filepath)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        _, content = read_object(sha1)
-        with open(full_path, 'wb') as f:
-            f.write(content)
-
-    for filepath in files_to_delete:
-        dir_name = os.path.dirname(os.path.join(repo_root, filepath))
-        try:
-            if dir_name and not os.listdir(dir_name):
-                os.rmdir(dir_name)
-        except OSError:
-            pass
-
-    write_index(new_tree)
+    _switch_worktree(repo_root, old_tree, new_tree)
 
     is_branch = get_branch_commit(name) is not None
     if is_branch:
@@ -307,24 +472,24 @@ def diff(staged=None):
         to_tree = read_index()
     else:
         from_tree = read_index()
-        to_tree = {}
-        for filepath in from_tree:
-            if os.path.exists(filepath):
-                with open(filepath, 'rb') as f:
-                    to_tree[filepath] = hash_object(f.read())
+        repo_root = find_repo_root()
+        stat_cache = read_stat_cache()
+        tracked = _stat_tracked(repo_root, from_tree)
+        # compare_files reads both sides from the object store
+        to_tree = _hash_tracked_files(tracked, stat_cache, from_tree, write=True)
+        _update_stat_cache(stat_cache, tracked, to_tree)
 
     added, deleted, modified = compare_trees(from_tree, to_tree)
 
     for f in added: print(f"Added: {f}")
     for f in deleted: print(f"Deleted: {f}")
     for f in modified:
-        diff_output = compare_files(from_tree[f], to_tree[f], f, f)
-        for line in diff_output:
-            print(line)
+        sys.stdout.writelines(line + '\n' for line in compare_files(from_tree[f], to_tree[f], f, f))
 
 
 def merge(branch_name):
-    head_commit = get_head_commit()
+    head = load_head()
+    head_commit = head.commit_sha
     other_commit = get_branch_commit(branch_name)
 
     if not other_commit or head_commit == other_commit:
@@ -336,18 +501,19 @@ def merge(branch_name):
         print("Already up to date.")
         return
 
-    other_history = get_full_history_set(other_commit)
-    if head_commit in other_history:
+    # The first boundary commit is the merge base; reaching head means a fast-forward
+    boundary = list(iter_boundary_commits(other_commit, head_history))
+    if head_commit in boundary:
         print(f"Fast-forwarding to {branch_name}")
         checkout(branch_name)
         return
 
-    base_commit = find_common_ancestor(head_commit, other_commit)
+    base_commit = boundary[0] if boundary else None
     if not base_commit:
         print("Error: No common ancestor found.", file=sys.stderr)
         return False
 
-    print(f"Merging {branch_name} into {get_head_ref().split('/')[-1]}")
+    print(f"Merging {branch_name} into {head.branch_name or 'HEAD'}")
     print(f"Common ancestor is {base_commit[:7]}")
 
     base_tree = get_tree_contents(get_commit_tree(base_commit))
@@ -371,8 +537,11 @@ def merge(branch_name):
         for path in conflicts:
             _, head_content = read_object(head_tree[path])
             _, other_content = read_object(other_tree[path])
-            conflict_content = (
-                f'<<<<<<< HEAD\n{head_content.decode()}\n=======\n{other_content.decode()}\n>>>>>>> {branch_name}\n').encode()
+            # Bytes, so non-utf-8 content survives
+            conflict_content = b"".join([
+                b"<<<<<<< HEAD\n", head_content, b"\n=======\n", other_content,
+                b"\n>>>>>>> ", branch_name.encode(), b"\n",
+            ])
             with open(path, 'wb') as f: f.write(conflict_content)
             merged_tree[path] = hash_object(conflict_content, 'blob')
         write_index(merged_tree)
@@ -381,17 +550,13 @@ def merge(branch_name):
     print("Automatic merge successful.")
 
     commit_message = f"Merge branch '{branch_name}'"
-    merged_tree_sha = hash_object(json.dumps(merged_tree, sort_keys=True).encode(), 'tree')
+    merged_tree_sha = write_tree(merged_tree)
     merge_commit_sha = _create_commit(commit_message, merged_tree_sha, [head_commit, other_commit])
 
-    head_ref = get_head_ref()
-    pygit_dir = find_pygit_dir()
-    branch_path = os.path.join(pygit_dir, head_ref)
-    with open(branch_path, 'w') as f:
-        f.write(merge_commit_sha)
+    _advance_head(head, merge_commit_sha)
+    _switch_worktree(find_repo_root(), head_tree, merged_tree)
 
     print(f"Merge made by the 'three-way' strategy. New commit: {merge_commit_sha[:7]}")
-    checkout(get_head_ref().split('/')[-1])
 
 
 def tag(*args):
@@ -439,34 +604,30 @@ def stash(*args):
         return
 
     if subcommand == 'push':
-        head_commit = get_head_commit()
+        head = load_head()
+        head_commit = head.commit_sha
         index_tree = read_index()
 
-        pygit_dir = find_pygit_dir()
-        repo_root = os.path.dirname(pygit_dir)
-        workdir_tree = {}
-        for filepath in index_tree.keys():
-            full_path = os.path.join(repo_root, filepath)
-            if os.path.exists(full_path):
-                with open(full_path, 'rb') as f:
-                    workdir_tree[filepath] = hash_object(f.read(), 'blob')
+        repo_root = find_repo_root()
+        tracked = _stat_tracked(repo_root, index_tree)
+        workdir_tree = _hash_tracked_files(tracked, read_stat_cache(), index_tree, write=True)
 
-        index_tree_sha = hash_object(json.dumps(index_tree, sort_keys=True).encode(), 'tree')
-        workdir_tree_sha = hash_object(json.dumps(workdir_tree, sort_keys=True).encode(), 'tree')
+        index_tree_sha = write_tree(index_tree)
+        workdir_tree_sha = write_tree(workdir_tree)
 
         if index_tree_sha == get_commit_tree(head_commit) and workdir_tree == index_tree:
             print("No local changes to save")
             return
 
-        message = f"Stash on {get_head_ref()}: WIP"
-        stash_hash = _create_commit(message, index_tree_sha, [head_commit, workdir_tree_sha])
+        message = f"Stash on {head.ref}: WIP"
+        # Never on a branch, so log never needs them
+        stash_hash = _create_commit(message, index_tree_sha, [head_commit, workdir_tree_sha], in_commit_graph=False)
 
         stashes = read_stash()
         stashes.insert(0, stash_hash)
         write_stash(stashes)
 
-        checkout(head_commit)
-        write_index(get_tree_contents(get_commit_tree(head_commit)))
+        _switch_worktree(repo_root, index_tree, get_tree_contents(get_commit_tree(head_commit)), reset=True)
 
         print(f"Saved working directory and index state as stash@{{{len(stashes) - 1}}}")
         return
@@ -479,16 +640,16 @@ def stash(*args):
 
         stash_hash = stashes[0]
         _, stash_content = read_object(stash_hash)
-        lines = stash_content.decode().split('\n')
-
-        index_tree_sha = lines[0].split(' ')[1]
-        workdir_tree_sha = [l.split(' ')[1] for l in lines if l.startswith('parent ')][1]
+        # The tree is the index snapshot and the second "parent" is the working-tree tree
+        index_tree_sha = stash_content[len(b'tree '):stash_content.index(b'\n')].decode()
+        workdir_tree_sha = get_commit_parents(stash_content)[1]
 
         index_tree = get_tree_contents(index_tree_sha)
         workdir_tree = get_tree_contents(workdir_tree_sha)
 
+        repo_root = find_repo_root()
+        _write_tree_files(repo_root, workdir_tree)
         write_index(index_tree)
-        checkout(get_head_commit())
 
         print(f"Applied stash@{{0}}")
 
@@ -509,26 +670,18 @@ def clean(*args):
         return False
 
     index_tree = read_index()
-    pygit_dir = find_pygit_dir()
-    repo_root = os.path.dirname(pygit_dir)
-    gitignore_patterns = _read_gitignore()
+    repo_root = find_repo_root()
+    ignore = read_gitignore()
 
     untracked_files, untracked_dirs = [], []
+    tracked_dirs = _index_dirs(index_tree) if clean_dirs else set()
 
-    for root, dirs, files in os.walk(repo_root):
-        if '.pygit' in dirs:
-            dirs.remove('.pygit')
-
-        for name in files:
-            filepath = os.path.relpath(os.path.join(root, name), repo_root)
-            if filepath not in index_tree and not _is_ignored(filepath, gitignore_patterns):
-                untracked_files.append(filepath)
-
-        if clean_dirs:
-            for name in dirs:
-                dirpath = os.path.relpath(os.path.join(root, name), repo_root)
-                if not any(f.startswith(dirpath) for f in index_tree) and not _is_ignored(dirpath, gitignore_patterns):
-                    untracked_dirs.append(dirpath)
+    for path, entry in _iter_worktree(repo_root, include_dirs=clean_dirs, prune=ignore.excludes_dir):
+        if entry.is_dir():
+            if path not in tracked_dirs and not ignore.is_ignored(path):
+                untracked_dirs.append(path)
+        elif path not in index_tree and not ignore.is_ignored(path):
+            untracked_files.append(path)
 
     if dry_run:
         for f in untracked_files: print(f"Would remove {f}")
@@ -571,12 +724,12 @@ def config(*args):
 
 
 def rebase(target_branch):
-    current_ref = get_head_ref()
-    if not current_ref.startswith('refs/heads/'):
+    head = load_head()
+    if not head.is_branch:
         print("Cannot rebase: HEAD is detached.", file=sys.stderr)
         return False
-    current_branch = current_ref.split('/')[-1]
-    current_commit = get_head_commit()
+    current_branch = head.branch_name
+    current_commit = head.commit_sha
 
     target_commit = get_branch_commit(target_branch)
     if not target_commit:
@@ -587,7 +740,7 @@ def rebase(target_branch):
         print("Already up to date.")
         return True
 
-    base_commit = find_common_ancestor(current_commit, target_commit)
+    base_commit = find_common_ancestor(target_commit, current_commit)
     if not base_commit:
         print("Error: No common ancestor found.", file=sys.stderr)
         return False
@@ -613,15 +766,9 @@ def rebase(target_branch):
 
     target_tree = get_tree_contents(get_commit_tree(target_commit))
 
-    pygit_dir = find_pygit_dir()
-    repo_root = os.path.dirname(pygit_dir)
+    repo_root = find_repo_root()
 
-    for filepath, sha1 in target_tree.items():
-        full_path = os.path.join(repo_root, filepath)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        _, content = read_object(sha1)
-        with open(full_path, 'wb') as f:
-            f.write(content)
+    _write_tree_files(repo_root, target_tree)
 
     new_base = target_commit
     for commit_sha, content in commits_to_replay:
@@ -633,7 +780,7 @@ def rebase(target_branch):
         combined_tree = target_tree.copy()
         combined_tree.update(original_tree)
 
-        combined_tree_sha = hash_object(json.dumps(combined_tree, sort_keys=True).encode(), 'tree')
+        combined_tree_sha = write_tree(combined_tree)
 
         new_commit = _create_commit(message, combined_tree_sha, [new_base])
 
@@ -643,10 +790,7 @@ def rebase(target_branch):
 
         print(f"Replayed commit: {commit_sha[:7]} -> {new_commit[:7]}")
 
-    pygit_dir = find_pygit_dir()
-    branch_path = os.path.join(pygit_dir, current_ref)
-    with open(branch_path, 'w') as f:
-        f.write(new_base)
+    _advance_head(head, new_base)
 
     checkout(current_branch)
 
@@ -659,10 +803,10 @@ def show(ref_name='HEAD'):
     tag_sha1 = get_tag_ref(ref_name)
 
     if tag_sha1:
-        obj_type, content = read_object(tag_sha1)
+        obj_type, content = read_object_head(tag_sha1, TAG_TARGET_LENGTH)
         if obj_type == 'tag':
             pretty_print_object(tag_sha1)
-            commit_sha1 = content.decode().split('\n')[0].split(' ')[1]
+            commit_sha1 = content[len(b'object '):].decode()
             print("\n")
             pretty_print_object(commit_sha1)
             return True
@@ -673,11 +817,11 @@ def show(ref_name='HEAD'):
               file=sys.stderr)
         return False
 
-    obj_type, content = read_object(sha1)
+    obj_type, content = read_object_head(sha1, TAG_TARGET_LENGTH)
     pretty_print_object(sha1)
 
     if obj_type == 'tag':
-        commit_sha1 = content.decode().split('\n')[0].split(' ')[1]
+        commit_sha1 = content[len(b'object '):].decode()
         print("\n")
         pretty_print_object(commit_sha1)
 
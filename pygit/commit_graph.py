@@ -0,0 +1,84 @@
+import os
+import mmap
+import struct
+import zlib
+from .repository import find_pygit_dir, create_lock_file
+
+# Append-only commit summaries for log. Per record: raw sha, raw first parent (zeros for a root), payload length,
+# "<author line>\n<message>", then a length + crc32 trailer so the file reads newest first and torn writes show
+COMMIT_GRAPH_FILE = 'commit-graph'
+_RECORD = struct.Struct('>20s20sI')
+_TRAILER = struct.Struct('>II')
+_NO_PARENT = bytes(20)
+
+
+def _graph_path():
+    pygit_dir = find_pygit_dir()
+    return os.path.join(pygit_dir, COMMIT_GRAPH_FILE) if pygit_dir else None
+
+
+def _record_before(data, end):
+    # The record whose trailer ends at `end`, or None if there isn't a valid one
+    if end < _RECORD.size + _TRAILER.size: return None
+    record_len, crc = _TRAILER.unpack_from(data, end - _TRAILER.size)
+    start = end - _TRAILER.size - record_len
+    if record_len < _RECORD.size or start < 0: return None
+    record = data[start:end - _TRAILER.size]
+    if crc != zlib.crc32(record) or _RECORD.size + _RECORD.unpack_from(record)[2] != record_len: return None
+    return start, record
+
+
+def _valid_length(data):
+    offset = 0
+    while offset + _RECORD.size <= len(data):
+        end = offset + _RECORD.size + _RECORD.unpack_from(data, offset)[2] + _TRAILER.size
+        found = end <= len(data) and _record_before(data, end)
+        if not found or found[0] != offset: break
+        offset = end
+    return offset
+
+
+def append_commit(sha1, parent_sha1, author, message):
+    path = _graph_path()
+    if not path: return
+    payload = author + b'\n' + message
+    parent = bytes.fromhex(parent_sha1) if parent_sha1 else _NO_PARENT
+    record = _RECORD.pack(bytes.fromhex(sha1), parent, len(payload)) + payload
+    try:
+        lock_path, fd = create_lock_file(path)
+    except FileExistsError:
+        # Another commit is appending; log falls back to the object
+        return
+    try:
+        os.close(fd)
+        with open(path, 'a+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    valid = size if _record_before(data, size) else _valid_length(data)
+                # Drop a torn append or an old-layout file
+                if valid != size: f.truncate(valid)
+            f.write(record + _TRAILER.pack(len(record), zlib.crc32(record)))
+    finally:
+        os.unlink(lock_path)
+
+
+def iter_commit_graph():
+    # (sha1, parent_sha1, author, message) for each recorded commit, newest first
+    path = _graph_path()
+    if not path: return
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        end = os.fstat(f.fileno()).st_size
+        if not end: return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while True:
+                found = _record_before(data, end)
+                if not found: return
+                end, record = found
+                sha, parent, _ = _RECORD.unpack_from(record)
+                author, _, message = record[_RECORD.size:].partition(b'\n')
+                yield sha.hex(), parent.hex() if parent != _NO_PARENT else None, author, message
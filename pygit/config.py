@@ -2,6 +2,11 @@ import os
 import json
 from .repository import find_pygit_dir
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 def get_config_path():
     pygit_dir = find_pygit_dir()
     if not pygit_dir:
@@ -14,11 +19,12 @@ def read_config():
     if not config_path or not os.path.exists(config_path):
         return {}
 
-    with open(config_path, 'r') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
+    with open(config_path, 'rb') as f:
+        data = f.read()
+    try:
+        return orjson.loads(data) if orjson else json.loads(data)
+    except json.JSONDecodeError:
+        return {}
 
 
 def write_config(config_data):
@@ -18,19 +18,17 @@ def compare_files(from_sha1, to_sha1, from_path, to_path):
         lineterm=''
     )
 
-    return list(diff)
+    return diff
 
 
 def compare_trees(from_tree, to_tree):
-    from_files = set(from_tree.keys())
-    to_files = set(to_tree.keys())
-
-    added = to_files - from_files
-    deleted = from_files - to_files
-
-    potential_modified = from_files & to_files
-    modified = {
-        f for f in potential_modified if from_tree[f] != to_tree[f]
-    }
+    # The common case, e.g. status with nothing staged
+    if from_tree == to_tree:
+        return [], [], []
+
+    from_paths, to_paths = from_tree.keys(), to_tree.keys()
+    added = sorted(to_paths - from_paths)
+    deleted = sorted(from_paths - to_paths)
+    modified = sorted(path for path in from_paths & to_paths if from_tree[path] != to_tree[path])
 
     return added, deleted, modified
@@ -0,0 +1,100 @@
+import os
+import re
+import fnmatch
+from .repository import find_repo_root
+
+_GLOB_CHARS = ('*', '?', '[')
+
+
+def _is_literal(text):
+    return not any(c in text for c in _GLOB_CHARS)
+
+
+def _literal_prefix(pattern):
+    end = min((i for i in map(pattern.find, _GLOB_CHARS) if i >= 0), default=len(pattern))
+    return pattern[:end]
+
+
+class IgnoreMatcher:
+    def __init__(self, patterns=()):
+        # "!pattern" lines re-include paths the other patterns would ignore
+        negations = {pattern[1:] for pattern in patterns if pattern.startswith('!')}
+        patterns = [pattern for pattern in patterns if not pattern.startswith('!')]
+        self.negation = IgnoreMatcher(negations) if negations else None
+        self.negation_prefixes = tuple(_literal_prefix(pattern) for pattern in negations)
+
+        # Common pattern shapes get cheap checks so most lookups never reach the regex
+        dir_prefixes, dir_names, extensions, exact, alternatives, regex_prefixes = [], set(), set(), set(), [], set()
+        for pattern in sorted(patterns):
+            if pattern.endswith('/'):
+                dir_prefixes.append(pattern)
+                dir_names.add(pattern.rstrip('/'))
+                if not _is_literal(pattern):
+                    alternatives.append(fnmatch.translate(pattern))
+                    regex_prefixes.add(_literal_prefix(pattern))
+            elif pattern.startswith('*.') and _is_literal(pattern[2:]) and '.' not in pattern[2:] \
+                    and '/' not in pattern[2:]:
+                extensions.add(pattern[2:])
+            elif _is_literal(pattern):
+                exact.add(pattern)
+            else:
+                alternatives.append(fnmatch.translate(pattern))
+                regex_prefixes.add(_literal_prefix(pattern))
+
+        self.dir_prefixes = tuple(dir_prefixes)
+        self.literal_dir_prefixes = tuple(prefix for prefix in dir_prefixes if _is_literal(prefix))
+        self.dir_names = frozenset(dir_names)
+        self.extensions = frozenset(extensions)
+        self.exact = frozenset(exact)
+        self.regex = re.compile('|'.join(alternatives)) if alternatives else None
+        # A glob's literal lead-in, e.g. "docs/" for "docs/*.tmp"
+        self.regex_prefixes = tuple(sorted(regex_prefixes))
+
+    def is_ignored(self, filepath):
+        if os.sep != '/':
+            filepath = filepath.replace(os.sep, '/')
+        if not self._matches(filepath):
+            return False
+        return self.negation is None or not self.negation._matches(filepath)
+
+    def excludes_dir(self, dirpath):
+        # True only when everything below dirpath is ignored and no negation reaches inside
+        prefix = dirpath + '/'
+        if not prefix.startswith(self.literal_dir_prefixes):
+            return False
+        return not any(prefix.startswith(neg) or neg.startswith(prefix) for neg in self.negation_prefixes)
+
+    def _matches(self, filepath):
+        if filepath in self.exact or filepath in self.dir_names:
+            return True
+        if self.dir_prefixes and filepath.startswith(self.dir_prefixes):
+            return True
+        if self.extensions:
+            _, dot, extension = filepath.rpartition('.')
+            if dot and extension in self.extensions:
+                return True
+        if self.regex is None or not filepath.startswith(self.regex_prefixes):
+            return False
+        return self.regex.match(filepath) is not None
+
+
+# Keyed by (path, mtime_ns, size)
+_matcher_cache = {}
+
+
+def read_gitignore():
+    repo_root = find_repo_root()
+    if not repo_root: return IgnoreMatcher()
+    gitignore_path = os.path.join(repo_root, '.gitignore')
+    try:
+        st = os.stat(gitignore_path)
+    except FileNotFoundError:
+        return IgnoreMatcher()
+
+    key = (gitignore_path, st.st_mtime_ns, st.st_size)
+    matcher = _matcher_cache.get(key)
+    if matcher is None:
+        with open(gitignore_path, 'r') as f:
+            matcher = IgnoreMatcher({line.strip() for line in f if line.strip() and not line.startswith('#')})
+        _matcher_cache[key] = matcher
+    return matcher
@@ -1,18 +1,103 @@
 import os
 import json
-from .repository import find_pygit_dir
+import time
+import struct
+from .repository import find_pygit_dir, write_file_atomic
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Magic and entry count, then per entry: raw sha1, path length, utf-8 path
+INDEX_MAGIC = b'PGIX'
+_INDEX_HEADER = struct.Struct('>4sI')
+_INDEX_ENTRY = struct.Struct('>20sH')
+
+# Entries modified this recently may still change within the same timestamp tick
+RACY_WINDOW_NS = 2 * 10**9
+
+# Index bytes last read or written, per path
+_index_on_disk = {}
+
+
+def _load_json(path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        return orjson.loads(data) if orjson else json.loads(data)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _dump_json(path, data):
+    write_file_atomic(path, orjson.dumps(data) if orjson else json.dumps(data, separators=(',', ':')).encode())
+
 
 def read_index():
     pygit_dir = find_pygit_dir()
     index_path = os.path.join(pygit_dir, 'index')
     try:
-        with open(index_path, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+        with open(index_path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
         return {}
+    if not data.startswith(INDEX_MAGIC):
+        # Repositories created before the binary format still have a JSON index
+        return _load_json(index_path) if data.strip() else {}
+
+    _index_on_disk[index_path] = data
+    view = memoryview(data)
+    _, count = _INDEX_HEADER.unpack_from(view)
+    offset = _INDEX_HEADER.size
+    index = {}
+    for _ in range(count):
+        raw_sha1, path_len = _INDEX_ENTRY.unpack_from(view, offset)
+        offset += _INDEX_ENTRY.size
+        index[str(view[offset:offset + path_len], 'utf-8')] = raw_sha1.hex()
+        offset += path_len
+    return index
+
 
 def write_index(index_data):
     pygit_dir = find_pygit_dir()
     index_path = os.path.join(pygit_dir, 'index')
-    with open(index_path, 'w') as f:
-        json.dump(index_data, f, indent = 4)
\ No newline at end of file
+    buf = bytearray(_INDEX_HEADER.pack(INDEX_MAGIC, len(index_data)))
+    for path, sha1 in index_data.items():
+        encoded_path = path.encode()
+        buf += _INDEX_ENTRY.pack(bytes.fromhex(sha1), len(encoded_path))
+        buf += encoded_path
+    data = bytes(buf)
+    if _index_on_disk.get(index_path) == data:
+        return
+    write_file_atomic(index_path, data)
+    _index_on_disk[index_path] = data
+
+
+def read_stat_cache():
+    pygit_dir = find_pygit_dir()
+    return _load_json(os.path.join(pygit_dir, 'index_stat'))
+
+
+def write_stat_cache(stat_cache):
+    pygit_dir = find_pygit_dir()
+    try:
+        _dump_json(os.path.join(pygit_dir, 'index_stat'), stat_cache)
+    except OSError:
+        # Read-only or locked; losing a cache update is harmless
+        pass
+
+
+def lookup_stat_cache(stat_cache, filepath, st):
+    entry = stat_cache.get(filepath)
+    if entry and entry[:4] == [st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino]:
+        return entry[4]
+    return None
+
+
+def stat_cache_entry(st, sha1):
+    return [st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino, sha1]
+
+
+def racy_cutoff():
+    return time.time_ns() - RACY_WINDOW_NS
@@ -1,61 +1,306 @@
 import os
-import zlib
+import itertools
 import hashlib
 import json
+import mmap
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from .repository import find_pygit_dir
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # Same streams as zlib, several times faster
+    from isal import isal_zlib as zlib
+except ImportError:
+    import zlib
+
+STREAM_CHUNK_SIZE = 256 * 1024
+# "<type> <size>\0" always fits in this many bytes
+_HEADER_MAX = 32
+_HEAD_READ_SIZE = 512
+# Below this, mapping an object file costs more than copying it into memory
+_MMAP_THRESHOLD = 64 * 1024
+# A tag body starts with "object <sha1>"
+TAG_TARGET_LENGTH = len('object ') + 40
+# Much faster than the default level for little size
+COMPRESSION_LEVEL = 1
+
+
+def _new_sha1(data=b''):
+    # Object ids aren't a security boundary; keeps SHA-1 usable on FIPS builds
+    return hashlib.sha1(data, usedforsecurity=False)
+
+
+# Commits, trees and tags only; blobs can be large and are read once
+_OBJECT_CACHE_MAX = 4096
+_object_cache = {}
+
+# Objects are never deleted, so a path seen once needs no further existence check
+_known_objects = set()
+
+
+def object_path(pygit_dir, sha1):
+    # Git's loose-object layout
+    return os.path.join(pygit_dir, 'objects', sha1[:2], sha1[2:])
+
+
+def _open_object(pygit_dir, sha1):
+    try:
+        return open(object_path(pygit_dir, sha1), 'rb')
+    except FileNotFoundError:
+        pass
+    # Repositories created before sharding keep their objects directly under objects/
+    try:
+        return open(os.path.join(pygit_dir, 'objects', sha1), 'rb')
+    except FileNotFoundError:
+        return None
+
+
+def _has_object(path):
+    if path in _known_objects: return True
+    if os.path.exists(path):
+        _known_objects.add(path)
+        return True
+    return False
+
+
+def _iter_compressed(chunks):
+    compressor = zlib.compressobj(COMPRESSION_LEVEL)
+    for chunk in chunks:
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+def _write_temp_object(pygit_dir, compressed_chunks):
+    # Renamed into place, so a reader never sees a partial object
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.join(pygit_dir, 'objects'), prefix='tmp_obj_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.writelines(compressed_chunks)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path
+
+
+def _place_object(path, tmp_path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.chmod(tmp_path, 0o444)
+    try:
+        os.replace(tmp_path, path)
+    except (PermissionError, FileExistsError):
+        # Windows won't replace a read-only file; another writer may have stored it first
+        os.chmod(tmp_path, 0o644)
+        os.unlink(tmp_path)
+        if not _has_object(path): raise
+        return
+    _known_objects.add(path)
+
+
+def _store_object(pygit_dir, sha1, compressed_chunks):
+    path = object_path(pygit_dir, sha1)
+    if not _has_object(path):
+        _place_object(path, _write_temp_object(pygit_dir, compressed_chunks))
+
 
 def read_object(sha1):
+    cached = _object_cache.get(sha1)
+    if cached: return cached
+
     pygit_dir = find_pygit_dir()
     if not pygit_dir: return None, None
 
-    object_path = os.path.join(pygit_dir, 'objects', sha1)
-    if not os.path.exists(object_path):
-        return None, None
-
-    with open(object_path, 'rb') as f:
-        compressed_data = f.read()
+    f = _open_object(pygit_dir, sha1)
+    if f is None: return None, None
+    with f:
+        if os.fstat(f.fileno()).st_size >= _MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                decompressed_data = zlib.decompress(mapped)
+        else:
+            decompressed_data = zlib.decompress(f.read())
 
-    decompressed_data = zlib.decompress(compressed_data)
     header_end = decompressed_data.find(b'\0')
-    header = decompressed_data[:header_end].decode()
+    obj_type = decompressed_data[:decompressed_data.find(b' ', 0, header_end)].decode()
     content = decompressed_data[header_end + 1:]
 
-    obj_type, _ = header.split(' ')
+    if obj_type != 'blob' and len(_object_cache) < _OBJECT_CACHE_MAX:
+        _object_cache[sha1] = obj_type, content
     return obj_type, content
 
 
+def read_object_head(sha1, length=0):
+    pygit_dir = find_pygit_dir()
+    if not pygit_dir: return None, None
+
+    f = _open_object(pygit_dir, sha1)
+    if f is None: return None, None
+
+    # Inflates only the header and the first `length` body bytes
+    wanted = _HEADER_MAX + length
+    decompressor = zlib.decompressobj()
+    data, pending = b'', b''
+    with f:
+        while len(data) < wanted and not decompressor.eof:
+            chunk = pending or f.read(_HEAD_READ_SIZE)
+            if not chunk: break
+            data += decompressor.decompress(chunk, wanted - len(data))
+            pending = decompressor.unconsumed_tail
+
+    header_end = data.find(b'\0')
+    obj_type = data[:header_end].split(b' ')[0].decode()
+    return obj_type, data[header_end + 1:header_end + 1 + length]
+
+
+def _iter_decompressed(f):
+    decompressor = zlib.decompressobj()
+    with f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as data:
+            for start in range(0, len(data), STREAM_CHUNK_SIZE):
+                yield decompressor.decompress(data[start:start + STREAM_CHUNK_SIZE])
+    yield decompressor.flush()
+
+
+def read_object_into(sha1, out_path):
+    pygit_dir = find_pygit_dir()
+    if not pygit_dir: return None
+
+    # Opened first, so a missing object never truncates out_path
+    f = _open_object(pygit_dir, sha1)
+    if f is None: return None
+
+    obj_type, pending = None, b''
+    with open(out_path, 'wb', buffering=STREAM_CHUNK_SIZE) as out:
+        for chunk in _iter_decompressed(f):
+            if obj_type is None:
+                pending += chunk
+                header_end = pending.find(b'\0')
+                if header_end < 0:
+                    continue
+                obj_type = pending[:header_end].split(b' ')[0].decode()
+                chunk = pending[header_end + 1:]
+            out.write(chunk)
+    return obj_type
+
+
+def read_objects_batch(sha1s):
+    if len(sha1s) < 2:
+        return [read_object(sha1) for sha1 in sha1s]
+    # File reads and zlib release the GIL
+    with ThreadPoolExecutor(max_workers=min(len(sha1s), os.cpu_count() or 1)) as executor:
+        return list(executor.map(read_object, sha1s))
+
+
 def hash_object(data, obj_type='blob'):
     pygit_dir = find_pygit_dir()
     if not pygit_dir: return None
 
-    header = f'{obj_type} {len(data)}\0'.encode()
-    full_data = header + data
-    sha1 = hashlib.sha1(full_data).hexdigest()
+    return hash_object_chunks((data,), len(data), obj_type)
+
+
+def hash_object_chunks(chunks, size, obj_type='blob'):
+    pygit_dir = find_pygit_dir()
+    if not pygit_dir: return None
+
+    # Hashed first, so an object already stored is never compressed
+    chunks = tuple(chunks)
+    header = f'{obj_type} {size}\0'.encode()
+    sha = _new_sha1(header)
+    for chunk in chunks:
+        sha.update(chunk)
+    sha1 = sha.hexdigest()
+
+    _store_object(pygit_dir, sha1, _iter_compressed(itertools.chain((header,), chunks)))
+    return sha1
+
+
+def hash_file(path, obj_type='blob', write=True):
+    pygit_dir = find_pygit_dir()
+    if not pygit_dir: return None
 
-    object_path = os.path.join(pygit_dir, 'objects', sha1)
-    if not os.path.exists(object_path):
-        with open(object_path, 'wb') as f:
-            f.write(zlib.compress(full_data))
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        header = f'{obj_type} {size}\0'.encode()
+        if not size:
+            return hash_object(b'', obj_type) if write else _new_sha1(header).hexdigest()
+        if not write and hasattr(hashlib, 'file_digest'):
+            # Python 3.11+
+            return hashlib.file_digest(f, lambda: _new_sha1(header)).hexdigest()
 
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            sha = _new_sha1(header)
+            sha.update(data)
+            sha1 = sha.hexdigest()
+            if write:
+                with memoryview(data) as view:
+                    windows = (view[start:start + STREAM_CHUNK_SIZE] for start in range(0, size, STREAM_CHUNK_SIZE))
+                    _store_object(pygit_dir, sha1, _iter_compressed(itertools.chain((header,), windows)))
     return sha1
 
 
+# Hits only: a missing object may be written later
+_commit_tree_cache = {}
+_tree_contents_cache = {}
+
+
 def get_commit_tree(commit_sha1):
-    _, content = read_object(commit_sha1)
+    tree_sha1 = _commit_tree_cache.get(commit_sha1)
+    if tree_sha1: return tree_sha1
+
+    # The tree line always comes first
+    _, content = read_object_head(commit_sha1, len(b'tree ') + 40 + 1)
     if not content: return None
 
-    tree_line = [line for line in content.decode().split('\n') if line.startswith('tree ')]
-    if tree_line:
-        return tree_line[0].split(' ')[1]
+    if content.startswith(b'tree '):
+        tree_sha1 = content[5:content.index(b'\n')].decode()
+        _commit_tree_cache[commit_sha1] = tree_sha1
+        return tree_sha1
     return None
 
 
+def _tree_entries(tree):
+    # Git's tree layout: "<mode> <path>\0<20-byte sha1>" per entry, sorted by path
+    return [b'100644 ' + path.encode() + b'\0' + bytes.fromhex(sha1) for path, sha1 in sorted(tree.items())]
+
+
+def serialize_tree(tree):
+    return b''.join(_tree_entries(tree))
+
+
+def parse_tree(content):
+    # Trees written before the binary format are JSON objects
+    if content[:1] == b'{':
+        return orjson.loads(content) if orjson else json.loads(content)
+
+    tree = {}
+    pos, end = 0, len(content)
+    while pos < end:
+        path_start = content.index(b' ', pos) + 1
+        path_end = content.index(b'\0', path_start)
+        tree[content[path_start:path_end].decode()] = content[path_end + 1:path_end + 21].hex()
+        pos = path_end + 21
+    return tree
+
+
+def write_tree(tree):
+    entries = _tree_entries(tree)
+    return hash_object_chunks(entries, sum(map(len, entries)), 'tree')
+
+
 def get_tree_contents(tree_sha1):
     if not tree_sha1: return {}
-    _, content = read_object(tree_sha1)
-    if not content: return {}
-    return json.loads(content.decode())
+    tree = _tree_contents_cache.get(tree_sha1)
+    if tree is None:
+        _, content = read_object(tree_sha1)
+        if not content: return {}
+        tree = _tree_contents_cache[tree_sha1] = parse_tree(content)
+    # Callers are free to modify the dict they get back
+    return dict(tree)
 
 
 def pretty_print_object(sha1):
@@ -65,20 +310,10 @@ def pretty_print_object(sha1):
         return
 
     if obj_type == 'commit':
-        lines = content.decode().split('\n')
-        metadata, message = [], []
-        is_message = False
-        for line in lines:
-            if not line.strip() and not is_message:
-                is_message = True
-                continue
-            if is_message:
-                message.append(line)
-            else:
-                metadata.append(line)
+        metadata, _, message = content.partition(b'\n\n')
         print(f"commit {sha1}")
-        print('\n'.join(metadata))
-        print('\n'.join(message))
+        print(metadata.decode())
+        print(message.decode())
 
     elif obj_type == 'tree':
         tree_data = get_tree_contents(sha1)
@@ -89,10 +324,8 @@ def pretty_print_object(sha1):
         print(content.decode(errors='ignore'))
 
     elif obj_type == 'tag':
-        lines = content.decode().split('\n')
         print(f"tag object {sha1}")
-        for line in lines:
-            print(line)
+        print(content.decode())
 
     else:
         print(f"fatal: unknown object type {obj_type}")
@@ -1,51 +1,75 @@
 import os
+import re
 import sys
-from .repository import find_pygit_dir
-from .objects import read_object, hash_object
+from dataclasses import dataclass
+from typing import Optional
+from .repository import LOCK_SUFFIX, find_pygit_dir, write_file_atomic
+from .objects import read_object_head, hash_object
 
+_SHA1_RE = re.compile(r'[0-9a-f]{40}')
 
-def get_head_ref():
+
+@dataclass(frozen=True)
+class HeadState:
+    ref: str
+    is_branch: bool
+    branch_name: Optional[str]
+    commit_sha: Optional[str]
+
+
+def _read_ref(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        return os.read(fd, 4096).decode().strip()
+    finally:
+        os.close(fd)
+
+
+def load_head():
     pygit_dir = find_pygit_dir()
     head_path = os.path.join(pygit_dir, 'HEAD')
     with open(head_path, 'r') as f:
         content = f.read().strip()
-    if content.startswith('ref:'):
-        return content.split(' ')[1]
-    return content
+    ref = content.split(' ')[1] if content.startswith('ref:') else content
 
+    if _SHA1_RE.fullmatch(ref):
+        commit_sha = ref
+    else:
+        commit_sha = _read_ref(os.path.join(pygit_dir, ref))
 
-def get_head_commit():
-    pygit_dir = find_pygit_dir()
-    head_ref_path = get_head_ref()
+    is_branch = ref.startswith('refs/heads/')
+    return HeadState(ref, is_branch, ref[len('refs/heads/'):] if is_branch else None, commit_sha)
 
-    if len(head_ref_path) == 40 and all(c in '0123456789abcdef' for c in head_ref_path):
-        return head_ref_path
 
-    ref_path = os.path.join(pygit_dir, head_ref_path)
-    if not os.path.exists(ref_path):
-        return None
+def get_head_ref():
+    return load_head().ref
 
-    with open(ref_path, 'r') as f:
-        return f.read().strip()
+
+def get_head_commit():
+    return load_head().commit_sha
 
 
 def get_branch_commit(branch_name):
     pygit_dir = find_pygit_dir()
-    branch_path = os.path.join(pygit_dir, 'refs', 'heads', branch_name)
-    if not os.path.exists(branch_path):
-        return None
-    with open(branch_path, 'r') as f:
-        return f.read().strip()
+    return _read_ref(os.path.join(pygit_dir, 'refs', 'heads', branch_name))
+
+
+def write_ref_atomic(path, value):
+    write_file_atomic(path, value.encode())
+
+
+def list_refs(refs_dir):
+    # Skips locks left by a crashed writer
+    return sorted(name for name in os.listdir(refs_dir) if not name.endswith(LOCK_SUFFIX))
 
 
 def update_head(ref, detached=False):
     pygit_dir = find_pygit_dir()
     head_file = os.path.join(pygit_dir, 'HEAD')
-    with open(head_file, 'w') as f:
-        if detached:
-            f.write(ref)
-        else:
-            f.write(f'ref: {ref}')
+    write_ref_atomic(head_file, ref if detached else f'ref: {ref}')
 
 
 def create_tag(tag_name, target_sha1, message=None, tagger_string="PyGit Tagger <tagger@pygit.com>"):
@@ -53,27 +77,30 @@ def create_tag(tag_name, target_sha1, message=None, tagger_string="PyGit Tagger
     tags_dir = os.path.join(pygit_dir, 'refs', 'tags')
     os.makedirs(tags_dir, exist_ok=True)
 
+    if tag_name.endswith(LOCK_SUFFIX):
+        print(f"Error: '{tag_name}' is not a valid tag name.", file=sys.stderr)
+        return False
+
     tag_path = os.path.join(tags_dir, tag_name)
     if os.path.exists(tag_path):
         print(f"Error: tag '{tag_name}' already exists.", file=sys.stderr)
         return False
 
     if message:
-        obj_type, _ = read_object(target_sha1)
-        tag_content = (
-            f"object {target_sha1}\n"
-            f"type {obj_type}\n"
-            f"tag {tag_name}\n"
-            f"tagger {tagger_string}\n\n"
-            f"{message}\n"
-        ).encode()
+        obj_type, _ = read_object_head(target_sha1)
+        tag_content = b"".join([
+            b"object ", target_sha1.encode(), b"\n",
+            b"type ", obj_type.encode(), b"\n",
+            b"tag ", tag_name.encode(), b"\n",
+            b"tagger ", tagger_string.encode(), b"\n\n",
+            message.encode(), b"\n",
+        ])
         tag_sha1 = hash_object(tag_content, 'tag')
         ref_value = tag_sha1
     else:
         ref_value = target_sha1
 
-    with open(tag_path, 'w') as f:
-        f.write(ref_value)
+    write_ref_atomic(tag_path, ref_value)
     return True
 
 
@@ -82,29 +109,23 @@ def list_tags():
     tags_dir = os.path.join(pygit_dir, 'refs', 'tags')
     if not os.path.exists(tags_dir):
         return []
-    return sorted(os.listdir(tags_dir))
+    return list_refs(tags_dir)
 
 
 def get_tag_ref(tag_name):
     pygit_dir = find_pygit_dir()
-    tag_path = os.path.join(pygit_dir, 'refs', 'tags', tag_name)
-    if not os.path.exists(tag_path):
-        return None
-    with open(tag_path, 'r') as f:
-        return f.read().strip()
+    return _read_ref(os.path.join(pygit_dir, 'refs', 'tags', tag_name))
 
 def read_stash():
     pygit_dir = find_pygit_dir()
-    stash_path = os.path.join(pygit_dir, 'refs', 'stash')
-    if not os.path.exists(stash_path):
+    try:
+        with open(os.path.join(pygit_dir, 'refs', 'stash'), 'r') as f:
+            return [line.strip() for line in f]
+    except FileNotFoundError:
         return []
-    with open(stash_path, 'r') as f:
-        return [line.strip() for line in f.readlines()]
 
 
 def write_stash(stashes):
     pygit_dir = find_pygit_dir()
     stash_path = os.path.join(pygit_dir, 'refs', 'stash')
-    with open(stash_path, 'w') as f:
-        for stash in stashes:
-            f.write(f"{stash}\n")
+    write_ref_atomic(stash_path, "".join(f"{stash}\n" for stash in stashes))
@@ -1,14 +1,25 @@
 import os
-import json
 
 PYGIT_DIR = '.pygit'
+LOCK_SUFFIX = '.lock'
+
+
+# Repository lookups keyed by the directory they started from; misses are not
+# cached so that a repository created later in the process (init, clone) is found.
+_pygit_dir_cache = {}
 
 
 def find_pygit_dir():
-    current_dir = os.getcwd()
+    start_dir = os.getcwd()
+    cached = _pygit_dir_cache.get(start_dir)
+    if cached:
+        return cached
+
+    current_dir = start_dir
     while True:
         pygit_dir = os.path.join(current_dir, PYGIT_DIR)
         if os.path.isdir(pygit_dir):
+            _pygit_dir_cache[start_dir] = pygit_dir
             return pygit_dir
 
         parent_dir = os.path.dirname(current_dir)
@@ -19,6 +30,32 @@ def find_pygit_dir():
         current_dir = parent_dir
 
 
+def create_lock_file(path):
+    # Created exclusively, so a second writer fails instead of racing the first
+    lock_path = path + LOCK_SUFFIX
+    try:
+        return lock_path, os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    except FileExistsError:
+        raise FileExistsError(f"unable to create '{lock_path}': another pygit process seems to be running. "
+                              f"If not, remove the file and try again.") from None
+
+
+def write_file_atomic(path, data):
+    lock_path, fd = create_lock_file(path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(lock_path, path)
+    except BaseException:
+        os.unlink(lock_path)
+        raise
+
+
+def find_repo_root():
+    pygit_dir = find_pygit_dir()
+    return os.path.dirname(pygit_dir) if pygit_dir else None
+
+
 def init():
     if os.path.exists(PYGIT_DIR):
         print(f"Error: PyGit repository already initialized in {os.path.abspath(PYGIT_DIR)}")
@@ -30,7 +67,7 @@ def init():
     with open(os.path.join(PYGIT_DIR, 'HEAD'), 'w') as f:
         f.write('ref: refs/heads/main\n')
 
-    with open(os.path.join(PYGIT_DIR, 'index'), 'w') as f:
-        json.dump({}, f)
+    # An empty index file reads back as an empty index
+    open(os.path.join(PYGIT_DIR, 'index'), 'wb').close()
 
     print(f"Initialized empty PyGit repository in {os.path.abspath(PYGIT_DIR)}")
\ No newline at end of file
@@ -1,7 +1,10 @@
 import os
+import re
 from .repository import find_pygit_dir
 from .refs import get_branch_commit, get_tag_ref
-from .objects import read_object
+from .objects import read_object_head, TAG_TARGET_LENGTH
+
+_SHA1_PREFIX_RE = re.compile(r'[0-9a-f]{4,}')
 
 
 def resolve_ref_to_commit(ref_name):
@@ -12,15 +15,30 @@ def resolve_ref_to_commit(ref_name):
     if not sha1:
         return None
     while True:
-        obj_type, content = read_object(sha1)
+        obj_type, content = read_object_head(sha1, TAG_TARGET_LENGTH)
         if obj_type == 'commit':
             return sha1
         elif obj_type == 'tag':
-            sha1 = content.decode().split('\n')[0].split(' ')[1]
+            sha1 = content[len(b'object '):].decode()
         else:
             return None
 
 
+def _iter_prefix_matches(objects_dir, prefix):
+    try:
+        with os.scandir(os.path.join(objects_dir, prefix[:2])) as it:
+            for entry in it:
+                if entry.name.startswith(prefix[2:]):
+                    yield prefix[:2] + entry.name
+    except FileNotFoundError:
+        pass
+    # Objects from before sharding sit directly under objects/
+    with os.scandir(objects_dir) as it:
+        for entry in it:
+            if len(entry.name) == 40 and entry.name.startswith(prefix):
+                yield entry.name
+
+
 def resolve_ref(name):
     pygit_dir = find_pygit_dir()
     if not pygit_dir:
@@ -34,13 +52,15 @@ def resolve_ref(name):
     if tag_ref:
         return tag_ref
 
-    if len(name) >= 4 and all(c in '0123456789abcdef' for c in name.lower()):
+    if _SHA1_PREFIX_RE.fullmatch(name.lower()):
         name = name.lower()
-        objects_dir = os.path.join(pygit_dir, 'objects')
-
-        matches = [obj for obj in os.listdir(objects_dir) if obj.startswith(name)]
+        matches = set()
+        for sha1 in _iter_prefix_matches(os.path.join(pygit_dir, 'objects'), name):
+            matches.add(sha1)
+            if len(matches) > 1:
+                break
         if len(matches) == 1:
-            return matches[0]
+            return matches.pop()
         elif len(matches) > 1:
             print(f"Error: ref '{name}' is ambiguous.")
             return None
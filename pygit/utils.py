@@ -1,15 +1,14 @@
-import collections
-from .objects import read_object
+import re
+from .objects import read_object, read_objects_batch
+
+
+# Root commits carry "parent None", which the hex pattern skips
+_PARENT_RE = re.compile(rb'^parent ([0-9a-f]{40})$', re.M)
 
 
 def get_commit_parents(commit_content):
-    parents = []
-    for line in commit_content.decode().split('\n'):
-        if line.startswith('parent '):
-            parent_sha = line.split(' ')[1]
-            if parent_sha != 'None':
-                parents.append(parent_sha)
-    return parents
+    header = commit_content.partition(b'\n\n')[0]
+    return [parent.decode() for parent in _PARENT_RE.findall(header)]
 
 
 def get_commit_history(start_commit_sha1):
@@ -25,48 +24,58 @@ def get_commit_history(start_commit_sha1):
         commit_sha1 = parents[0] if parents else None
 
 
-def get_full_history_set(start_commit_sha1):
-    if not start_commit_sha1:
-        return set()
-    history = set()
-    q = collections.deque([start_commit_sha1])
-    visited = {start_commit_sha1}
-
-    while q:
-        commit_sha1 = q.popleft()
-        if not commit_sha1:
-            continue
-
-        history.add(commit_sha1)
+_history_cache = {}
 
-        _, content = read_object(commit_sha1)
-        if not content: continue
 
-        parents = get_commit_parents(content)
-        for parent in parents:
-            if parent not in visited:
-                visited.add(parent)
-                q.append(parent)
+def get_full_history_set(start_commit_sha1):
+    if not start_commit_sha1:
+        return frozenset()
+    cached = _history_cache.get(start_commit_sha1)
+    if cached is not None:
+        return cached
+
+    history = {start_commit_sha1}
+    frontier = [start_commit_sha1]
+
+    # One generation at a time, each read as a batch
+    while frontier:
+        next_frontier = []
+        for _, content in read_objects_batch(frontier):
+            if not content: continue
+
+            for parent in get_commit_parents(content):
+                if parent not in history:
+                    history.add(parent)
+                    next_frontier.append(parent)
+        frontier = next_frontier
+
+    history = _history_cache[start_commit_sha1] = frozenset(history)
     return history
 
 
-def find_common_ancestor(commit1_sha, commit2_sha):
-    history1 = get_full_history_set(commit1_sha)
+def iter_boundary_commits(start_commit_sha1, history):
+    # Breadth-first from start, yielding the commits of `history` it reaches without walking into them
+    frontier = [start_commit_sha1]
+    visited = {start_commit_sha1}
 
-    q = collections.deque([commit2_sha])
-    visited = {commit2_sha}
+    # Hits are yielded before the generation's misses are read as a batch
+    while frontier:
+        misses = []
+        for sha in frontier:
+            if sha in history:
+                yield sha
+            else:
+                misses.append(sha)
 
-    while q:
-        current_sha = q.popleft()
-        if current_sha in history1:
-            return current_sha
+        frontier = []
+        for _, content in read_objects_batch(misses):
+            if not content: continue
 
-        _, content = read_object(current_sha)
-        if not content: continue
+            for parent in get_commit_parents(content):
+                if parent not in visited:
+                    visited.add(parent)
+                    frontier.append(parent)
 
-        parents = get_commit_parents(content)
-        for parent in parents:
-            if parent not in visited:
-                visited.add(parent)
-                q.append(parent)
-    return None
+
+def find_common_ancestor(commit1_sha, commit2_sha):
+    return next(iter_boundary_commits(commit2_sha, get_full_history_set(commit1_sha)), None)
@@ -3,28 +3,71 @@
 import unittest
 import sys
 import os
+import argparse
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from test_pygit import PyGitTest
 
+
+def run_parallel(jobs):
+    # setUp changes the working directory, which is process-wide, so parallel tests need separate processes.
+    # Each process runs a whole shard, so setUpClass builds the template repository once per process.
+    names = unittest.TestLoader().getTestCaseNames(PyGitTest)
+    shards = [names[i::jobs] for i in range(min(jobs, len(names)))]
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+
+    def run(shard):
+        tests = [f"test_pygit.PyGitTest.{name}" for name in shard]
+        return subprocess.run([sys.executable, "-m", "unittest", "-v"] + tests,
+                              cwd=project_dir, capture_output=True, text=True)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        for shard, result in zip(shards, executor.map(run, shards)):
+            # unittest -v reports on stderr, one "... ok" / "... FAIL" / "... ERROR" line per test
+            print(result.stderr)
+            shard_failed = len(re.findall(r' \.\.\. (?:FAIL|ERROR)$', result.stderr, re.M))
+            if result.returncode and not shard_failed:
+                # Nothing ran, e.g. setUpClass failed
+                shard_failed = len(shard)
+            failed += shard_failed
+    return len(names), failed
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of test processes to run at once (0 for one per CPU)")
+    jobs = parser.parse_args().jobs or os.cpu_count()
+
     print("=== Running PyGit Test Suite ===")
-    
-    # Create a test suite
-    suite = unittest.TestLoader().loadTestsFromTestCase(PyGitTest)
-    
-    # Run the tests
-    result = unittest.TextTestRunner(verbosity=2).run(suite)
-    
-    # Print summary
-    print("\n=== Test Summary ===")
-    print(f"Tests run: {result.testsRun}")
-    print(f"Failures: {len(result.failures)}")
-    print(f"Errors: {len(result.errors)}")
-    print(f"Skipped: {len(result.skipped)}")
-    
+
+    if jobs > 1:
+        tests_run, failed = run_parallel(jobs)
+        print("\n=== Test Summary ===")
+        print(f"Tests run: {tests_run}")
+        print(f"Failed: {failed}")
+        successful = not failed
+    else:
+        # Create a test suite
+        suite = unittest.TestLoader().loadTestsFromTestCase(PyGitTest)
+
+        # Run the tests
+        result = unittest.TextTestRunner(verbosity=2).run(suite)
+
+        # Print summary
+        print("\n=== Test Summary ===")
+        print(f"Tests run: {result.testsRun}")
+        print(f"Failures: {len(result.failures)}")
+        print(f"Errors: {len(result.errors)}")
+        print(f"Skipped: {len(result.skipped)}")
+        successful = result.wasSuccessful()
+
     # Exit with appropriate code
-    if result.wasSuccessful():
+    if successful:
         print("\n=== All tests passed! ===")
         sys.exit(0)
     else:
         print("\n=== Some tests failed! ===")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
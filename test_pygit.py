@@ -1,20 +1,40 @@
 import os
 import sys
 import unittest
+import shlex
 import shutil
 import subprocess
 import tempfile
 from pathlib import Path
 
+# Resolved once from this file's location, so the suite can be run from any directory
+PYGIT_PATH = str((Path(__file__).parent / "pygit.py").resolve())
+PYGIT_ARGV = [sys.executable, PYGIT_PATH]
+
 
 class PyGitTest(unittest.TestCase):
     """Test suite for PyGit functionality."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Build, once, a repository with one commit that tests copy instead of recreating."""
+        template = tempfile.TemporaryDirectory(prefix="pygit-template-")
+        cls.addClassCleanup(template.cleanup)
+        cls.template_dir = template.name
+        with open(os.path.join(cls.template_dir, "file1.txt"), "w") as f: f.write("content")
+        for args in (["init"], ["add", "file1.txt"], ["commit", "-m", "Initial commit"]):
+            subprocess.run(PYGIT_ARGV + args, cwd=cls.template_dir, capture_output=True, check=True)
+
     def setUp(self):
         """Set up a temporary directory for testing."""
-        # Create a main directory for the test run to contain both client and server repos
-        self.base_dir = tempfile.mkdtemp()
+        # Create a main directory for the test run to contain both client and server repos.
+        # Cleanups run last-in first-out, so the working directory is restored before the tree is removed,
+        # and both happen even when setUp or the test fails.
+        base = tempfile.TemporaryDirectory(prefix="pygit-test-")
+        self.addCleanup(base.cleanup)
+        self.base_dir = base.name
         self.original_dir = os.getcwd()
+        self.addCleanup(os.chdir, self.original_dir)
         os.chdir(self.base_dir)
 
         # The actual test repo will be inside the base_dir
@@ -22,26 +42,27 @@ class PyGitTest(unittest.TestCase):
         os.makedirs(self.test_dir)
         os.chdir(self.test_dir)
 
-        # Get the absolute path to the pygit.py script
-        # Assumes the test script is run from the project root
-        script_dir = Path(self.original_dir).absolute()
-        self.pygit_cmd = f"python3 {script_dir}/pygit.py"
-
-    def tearDown(self):
-        """Clean up after tests."""
-        os.chdir(self.original_dir)
-        shutil.rmtree(self.base_dir)
-
     def run_command(self, command, expect_fail=False):
         """Run a pygit command and return its output and return code."""
-        full_command = f"{self.pygit_cmd} {command}"
-        result = subprocess.run(full_command, shell=True, capture_output=True, text=True)
+        # The command line is split here rather than by a shell, so no /bin/sh is started per command
+        args = PYGIT_ARGV + shlex.split(command)
+        full_command = shlex.join(args)
+        # close_fds=False (safe: Python's own descriptors are non-inheritable) keeps subprocess on its posix_spawn path
+        result = subprocess.run(args, capture_output=True, text=True, close_fds=False)
         if not expect_fail and result.returncode != 0:
             self.fail(f"Command '{full_command}' failed with error:\n{result.stderr}")
         elif expect_fail and result.returncode == 0:
             self.fail(f"Command '{full_command}' was expected to fail but succeeded.")
         return result.stdout, result.stderr, result.returncode
 
+    def branch_commit(self, branch):
+        """Read a branch's commit straight from its ref file, without running a command."""
+        with open(os.path.join(".pygit", "refs", "heads", branch)) as f: return f.read().strip()
+
+    def init_with_commit(self):
+        """Start the test repo as file1.txt ("content") committed on main as "Initial commit"."""
+        shutil.copytree(self.template_dir, self.test_dir, dirs_exist_ok=True)
+
     def test_01_init(self):
         """Test the init command."""
         self.run_command("init")
@@ -56,12 +77,28 @@ class PyGitTest(unittest.TestCase):
         stdout, _, _ = self.run_command("log")
         self.assertIn("Initial commit", stdout, "Log did not show the initial commit")
 
+        # Without the commit graph, log reads the commit objects and prints the same output
+        os.remove(os.path.join(".pygit", "commit-graph"))
+        self.assertEqual(self.run_command("log")[0], stdout)
+
+        # A torn append is cut off by the next commit instead of corrupting the records behind it
+        with open("file1.txt", "w") as f: f.write("Second")
+        self.run_command("add file1.txt")
+        self.run_command("commit -m \"Second commit\"")
+        with open(os.path.join(".pygit", "commit-graph"), "r+b") as f:
+            f.truncate(os.path.getsize(f.name) - 3)
+        with open("file1.txt", "w") as f: f.write("Third")
+        self.run_command("add file1.txt")
+        self.run_command("commit -m \"Third commit\"")
+        stdout, _, _ = self.run_command("log")
+        for message in ("Initial commit", "Second commit", "Third commit"):
+            self.assertIn(message, stdout)
+        with open(os.path.join(".pygit", "commit-graph"), "rb") as f:
+            self.assertIn(b"Third commit", f.read())
+
     def test_03_status_diff(self):
         """Test the status and diff commands."""
-        self.run_command("init")
-        with open("file1.txt", "w") as f: f.write("content")
-        self.run_command("add file1.txt")
-        self.run_command("commit -m \"commit 1\"")
+        self.init_with_commit()
 
         with open("file1.txt", "a") as f: f.write("\nmore content")
         with open("untracked.txt", "w") as f: f.write("untracked")
@@ -69,18 +106,19 @@ class PyGitTest(unittest.TestCase):
         stdout, _, _ = self.run_command("status")
         self.assertIn("modified:   file1.txt", stdout)
         self.assertIn("untracked.txt", stdout)
+        stdout, _, _ = self.run_command("status --porcelain")
+        self.assertEqual(stdout.splitlines(), [" M file1.txt", "?? untracked.txt"])
 
         self.run_command("add file1.txt")
         stdout, _, _ = self.run_command("status")
         self.assertIn("Changes to be committed", stdout)
         self.assertIn("modified:   file1.txt", stdout)
+        stdout, _, _ = self.run_command("status --porcelain")
+        self.assertEqual(stdout.splitlines(), ["M  file1.txt", "?? untracked.txt"])
 
     def test_04_branch_checkout(self):
         """Test the branch and checkout commands."""
-        self.run_command("init")
-        with open("file1.txt", "w") as f: f.write("content")
-        self.run_command("add file1.txt")
-        self.run_command("commit -m \"Initial commit\"")
+        self.init_with_commit()
 
         self.run_command("branch feature-branch")
         self.run_command("checkout feature-branch")
@@ -91,15 +129,23 @@ class PyGitTest(unittest.TestCase):
         self.run_command("checkout main")
         self.assertFalse(os.path.exists("feature-file.txt"))
 
+        # Files that are the same on both branches keep their local edits
+        with open("file1.txt", "w") as f: f.write("local edit")
+        self.run_command("checkout feature-branch")
+        self.assertTrue(os.path.exists("feature-file.txt"))
+        with open("file1.txt") as f: self.assertEqual(f.read(), "local edit")
+
+        # ...and local deletions of them survive too
+        os.remove("file1.txt")
+        self.run_command("checkout main")
+        self.assertFalse(os.path.exists("feature-file.txt"))
+        self.assertFalse(os.path.exists("file1.txt"))
+
     def test_05_tag_and_show(self):
         """Test tag (lightweight and annotated) and show commands."""
-        self.run_command("init")
-        with open("file1.txt", "w") as f: f.write("content")
-        self.run_command("add file1.txt")
-        self.run_command("commit -m \"Initial commit\"")
+        self.init_with_commit()
 
-        stdout, _, _ = self.run_command("log")
-        commit_hash = stdout.split()[1]
+        commit_hash = self.branch_commit("main")
 
         # Lightweight tag
         self.run_command("tag v1.0")
@@ -145,6 +191,173 @@ class PyGitTest(unittest.TestCase):
         stdout, _, _ = self.run_command("remote")
         self.assertNotIn("test_remote", stdout)
 
+    def test_07_status_stat_cache(self):
+        """Test that status notices edits to files whose stat info was cached."""
+        self.run_command("init")
+        with open("file1.txt", "w") as f: f.write("content")
+        os.utime("file1.txt", ns=(1_000_000_000, 1_000_000_000))
+        self.run_command("add file1.txt")
+        self.run_command("commit -m \"Initial commit\"")
+
+        # The first status populates the stat cache, the second one reads it
+        for _ in range(2):
+            stdout, _, _ = self.run_command("status")
+            self.assertNotIn("modified:   file1.txt", stdout)
+        self.assertTrue(os.path.exists(os.path.join(".pygit", "index_stat")))
+
+        with open("file1.txt", "w") as f: f.write("CONTENT")
+        os.utime("file1.txt", ns=(2_000_000_000, 2_000_000_000))
+        stdout, _, _ = self.run_command("status")
+        self.assertIn("modified:   file1.txt", stdout)
+
+        # -uno still reports tracked changes but skips the untracked listing
+        with open("untracked.txt", "w") as f: f.write("untracked")
+        stdout, _, _ = self.run_command("status -uno")
+        self.assertIn("modified:   file1.txt", stdout)
+        self.assertNotIn("untracked.txt", stdout)
+
+        # Status still works when the stat cache can't be saved
+        os.chmod(".pygit", 0o555)
+        self.addCleanup(os.chmod, os.path.abspath(".pygit"), 0o755)
+        os.utime("file1.txt", ns=(3_000_000_000, 3_000_000_000))
+        stdout, _, _ = self.run_command("status")
+        self.assertIn("modified:   file1.txt", stdout)
+
+    def test_08_gitignore(self):
+        """Test that files matching .gitignore patterns are ignored."""
+        self.run_command("init")
+        with open(".gitignore", "w") as f: f.write("build/\n*.log\n!important.log\nsecret.txt\n")
+        os.makedirs("build/deep")
+        os.makedirs("sub")
+        for name in ["build/out.bin", "build/deep/x.bin", "app.log", "sub/debug.log", "secret.txt", "keep.txt",
+                     "important.log"]:
+            with open(name, "w") as f: f.write("data")
+
+        stdout, _, _ = self.run_command("status")
+        self.assertIn("keep.txt", stdout)
+        self.assertIn("important.log", stdout)
+        for name in ["build", "app.log", "debug.log", "secret.txt"]:
+            self.assertNotIn(name, stdout)
+
+        stdout, _, _ = self.run_command("add app.log keep.txt")
+        self.assertIn("Ignoring 'app.log'", stdout)
+        self.assertIn("Staged 'keep.txt'", stdout)
+        stdout, _, _ = self.run_command("status")
+        self.assertIn("new file:   keep.txt", stdout)
+
+        # A tracked file inside an ignored directory is still compared
+        with open(".gitignore", "w") as f: f.write("")
+        self.run_command("add build/deep/x.bin")
+        with open(".gitignore", "w") as f: f.write("build/\n")
+        with open("build/deep/x.bin", "w") as f: f.write("changed")
+        stdout, _, _ = self.run_command("status")
+        self.assertIn("modified:   build/deep/x.bin", stdout)
+        self.assertNotIn("out.bin", stdout)
+
+    def test_09_merge(self):
+        """Test three-way and conflicting merges."""
+        self.init_with_commit()
+
+        # Three-way merge of disjoint changes
+        self.run_command("branch feature")
+        with open("main.txt", "w") as f: f.write("main")
+        self.run_command("add main.txt")
+        self.run_command("commit -m \"main commit\"")
+        self.run_command("checkout feature")
+        with open("feature.txt", "w") as f: f.write("feature")
+        self.run_command("add feature.txt")
+        self.run_command("commit -m \"feature commit\"")
+        self.run_command("checkout main")
+        stdout, _, _ = self.run_command("merge feature")
+        self.assertIn("Automatic merge successful", stdout)
+        self.assertTrue(os.path.exists("feature.txt"))
+        self.assertTrue(os.path.exists("main.txt"))
+        stdout, _, _ = self.run_command("log")
+        self.assertIn("Merge branch 'feature'", stdout)
+        stdout, _, _ = self.run_command("merge feature")
+        self.assertIn("Already up to date", stdout)
+
+        # Conflicting edits
+        self.run_command("branch conflict")
+        with open("file1.txt", "w") as f: f.write("main side")
+        self.run_command("add file1.txt")
+        self.run_command("commit -m \"main edit\"")
+        self.run_command("checkout conflict")
+        with open("file1.txt", "w") as f: f.write("other side")
+        self.run_command("add file1.txt")
+        self.run_command("commit -m \"conflict edit\"")
+        self.run_command("checkout main")
+        stdout, _, _ = self.run_command("merge conflict", expect_fail=True)
+        self.assertIn("Automatic merge failed", stdout)
+        with open("file1.txt") as f: content = f.read()
+        self.assertIn("<<<<<<< HEAD\nmain side", content)
+        self.assertIn("other side\n>>>>>>> conflict", content)
+
+    def test_10_clean(self):
+        """Test the clean command with and without -d."""
+        self.run_command("init")
+        os.makedirs("tracked")
+        os.makedirs("junk/nested")
+        with open("tracked/file1.txt", "w") as f: f.write("content")
+        self.run_command("add tracked/file1.txt")
+        with open("junk/nested/tmp.txt", "w") as f: f.write("tmp")
+        with open("stray.txt", "w") as f: f.write("stray")
+
+        self.run_command("clean", expect_fail=True)
+
+        stdout, _, _ = self.run_command("clean -n -d")
+        self.assertIn("Would remove stray.txt", stdout)
+        self.assertIn("Would remove junk/", stdout)
+        self.assertNotIn("tracked", stdout)
+        self.assertTrue(os.path.exists("stray.txt"))
+
+        self.run_command("clean -f -d")
+        self.assertFalse(os.path.exists("stray.txt"))
+        self.assertFalse(os.path.exists("junk"))
+        self.assertTrue(os.path.exists("tracked/file1.txt"))
+
+    def test_11_stash(self):
+        """Test that stash push and pop save and restore local changes."""
+        self.init_with_commit()
+
+        with open("file1.txt", "w") as f: f.write("changed")
+        with open("new.txt", "w") as f: f.write("new")
+        self.run_command("add new.txt")
+        self.run_command("stash push")
+        with open("file1.txt") as f: self.assertEqual(f.read(), "content")
+        self.assertFalse(os.path.exists("new.txt"))
+        stdout, _, _ = self.run_command("status")
+        self.assertIn("On branch main", stdout)
+
+        self.run_command("stash pop")
+        with open("file1.txt") as f: self.assertEqual(f.read(), "changed")
+        stdout, _, _ = self.run_command("status")
+        self.assertIn("new file:   new.txt", stdout)
+        self.assertIn("modified:   file1.txt", stdout)
+        stdout, _, _ = self.run_command("stash list")
+        self.assertIn("No stashes", stdout)
+
+    def test_12_rebase(self):
+        """Test rebasing a branch onto another one."""
+        self.init_with_commit()
+        self.run_command("branch feature")
+        with open("main.txt", "w") as f: f.write("main")
+        self.run_command("add main.txt")
+        self.run_command("commit -m \"main commit\"")
+        self.run_command("checkout feature")
+        with open("feature.txt", "w") as f: f.write("feature")
+        self.run_command("add feature.txt")
+        self.run_command("commit -m \"feature commit\"")
+
+        stdout, _, _ = self.run_command("rebase main")
+        self.assertIn("Successfully rebased feature onto main", stdout)
+        self.assertTrue(os.path.exists("main.txt"))
+        self.assertTrue(os.path.exists("feature.txt"))
+        stdout, _, _ = self.run_command("status")
+        self.assertIn("On branch feature", stdout)
+        stdout, _, _ = self.run_command("log")
+        self.assertLess(stdout.index("feature commit"), stdout.index("main commit"))
+
 
 if __name__ == "__main__":
     unittest.main()